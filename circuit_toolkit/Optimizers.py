@@ -1,18 +1,251 @@
+import os
 import time
 import math
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import numpy as np
-from numpy import sqrt, zeros, floor, log, log2, eye, exp, linspace, logspace, log10, mean, std
+from numpy import sqrt, zeros, floor, log, log2, eye, linspace, logspace, log10, mean, std
 from numpy.linalg import norm
-from numpy.random import randn
-from circuit_toolkit.geometry_utils import ExpMap, renormalize, ang_dist, SLERP
+from scipy.linalg.blas import get_blas_funcs
+from circuit_toolkit.geometry_utils import ExpMap, renormalize, ang_dist_batch, SLERP
 import torch
-
-class CholeskyCMAES:
-    """ Note this is a variant of CMAES Cholesky suitable for high dimensional optimization"""
+try:
+    from numba import njit, prange
+    _NUMBA_AVAILABLE = True
+except ImportError:
+    # numba is optional, the optimizers fall back to the plain NumPy code path.
+    _NUMBA_AVAILABLE = False
+    prange = range
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+
+@njit(cache=True, fastmath=True, nogil=True)
+def _update_paths(ps, pc, randzw, A, cs, cc, c_ps, c_pc):
+    """ Fused in-place update of the evolution paths
+        ps = (1 - cs) * ps + c_ps * randzw,  c_ps = sqrt(cs * (2 - cs) * mueff)
+        pc = (1 - cc) * pc + c_pc * randzw @ A,  c_pc = sqrt(cc * (2 - cc) * mueff)
+    in a single sweep over `ps`, `pc` and `A` without temporaries. Returns norm(ps).
+    """
+    ps_sqnorm = 0.0
+    for i in range(ps.shape[0]):
+        ps[i] = (1 - cs) * ps[i] + c_ps * randzw[i]
+        ps_sqnorm += ps[i] * ps[i]
+    for j in range(pc.shape[0]):
+        pc[j] *= (1 - cc)
+    for i in range(A.shape[0]):  # accumulate randzw @ A row by row, A is C-contiguous
+        coef = c_pc * randzw[i]
+        for j in range(A.shape[1]):
+            pc[j] += coef * A[i, j]
+    return math.sqrt(ps_sqnorm)
+
+
+@njit(cache=True, fastmath=True, nogil=True)
+def _update_A_Ainv(A, Ainv, pc, sqrt_1mc1, c1_ratio):
+    """ In-place rank-1 update of the factors A (A' * A = C) and Ainv with search path `pc`,
+        v = pc @ Ainv
+        A = sqrt(1 - c1) * A + sqrt(1 - c1) / normv * (sqrt(1 + normv * c1 / (1 - c1)) - 1) * v.T @ pc
+        Ainv = 1 / sqrt(1 - c1) * Ainv - 1 / sqrt(1 - c1) / normv * (1 - 1 / sqrt(1 + normv * c1 / (1 - c1))) * Ainv @ v.T @ v
+    with the constants sqrt_1mc1 = sqrt(1 - c1), c1_ratio = c1 / (1 - c1).
+    """
+    v = np.zeros(Ainv.shape[1], dtype=Ainv.dtype)
+    for i in range(Ainv.shape[0]):  # v = pc @ Ainv
+        for j in range(Ainv.shape[1]):
+            v[j] += pc[i] * Ainv[i, j]
+    normv = 0.0
+    for j in range(v.shape[0]):
+        normv += v[j] * v[j]
+    w = np.zeros(Ainv.shape[0], dtype=Ainv.dtype)
+    for i in prange(Ainv.shape[0]):  # w = Ainv @ v.T, before Ainv is overwritten
+        acc = 0.0
+        for j in range(Ainv.shape[1]):
+            acc += Ainv[i, j] * v[j]
+        w[i] = acc
+    sqrt_term = math.sqrt(1 + normv * c1_ratio)
+    coef_A = sqrt_1mc1 / normv * (sqrt_term - 1)
+    coef_Ainv = 1 / sqrt_1mc1 / normv * (1 - 1 / sqrt_term)
+    for i in prange(A.shape[0]):  # rows are independent, prange only splits them in the parallel build
+        for j in range(A.shape[1]):
+            A[i, j] = sqrt_1mc1 * A[i, j] + coef_A * v[i] * pc[j]
+    for i in prange(Ainv.shape[0]):
+        for j in range(Ainv.shape[1]):
+            Ainv[i, j] = Ainv[i, j] / sqrt_1mc1 - coef_Ainv * w[i] * v[j]
+
+
+# Row-parallel build of the same kernel, used from _PARALLEL_MIN_DIMEN on where the threads pay off. Not cached:
+# numba's cache is keyed by the Python function, so it would hand back the serial build.
+_update_A_Ainv_parallel = njit(fastmath=True, nogil=True, parallel=True)(getattr(_update_A_Ainv, "py_func", _update_A_Ainv))
+_PARALLEL_MIN_DIMEN = 1024
+
+
+@njit(cache=True, fastmath=True, nogil=True)
+def _cma_inner(ps, pc, A, Ainv, randzw, cs, cc, c_ps, c_pc, sigma, sigma_coef, inv_chiN, sqrt_1mc1, c1_ratio,
+               do_update):
+    """ One CholeskyCMAES step after recombination in a single call: the path update, the step size adaptation
+        sigma = sigma * exp(sigma_coef * (norm(ps) * inv_chiN - 1)),  sigma_coef = cs / damps,  inv_chiN = 1 / chiN
+    and, if `do_update`, the rank-1 update of A and Ainv. The arrays are updated in place, the new sigma is returned.
+    """
+    ps_norm = _update_paths(ps, pc, randzw, A, cs, cc, c_ps, c_pc)
+    sigma = sigma * math.exp(sigma_coef * (ps_norm * inv_chiN - 1))
+    if do_update:
+        _update_A_Ainv(A, Ainv, pc, sqrt_1mc1, c1_ratio)
+    return sigma
+
+
+@njit(cache=True, fastmath=True, nogil=True)
+def _chol_rank1_update(R, x):
+    """ In-place rank-1 update of the upper triangular Cholesky factor R (R' * R = C) into the factor of
+    C + x' * x, by a sweep of N Givens rotations in O(N^2). R stays triangular and no inverse is needed.
+    Note `x` is overwritten. Row slices keep it vectorized when numba is not available.
+    """
+    n = x.shape[0]
+    for k in range(n):
+        r = math.sqrt(R[k, k] * R[k, k] + x[k] * x[k])
+        c = r / R[k, k]
+        s = x[k] / R[k, k]
+        R[k, k] = r
+        if k + 1 < n:
+            R[k, k + 1:] = (R[k, k + 1:] + s * x[k + 1:]) / c
+            x[k + 1:] = c * x[k + 1:] - s * R[k, k + 1:]
+
+
+def _ger_update(M, alpha, x, y):
+    """ M += alpha * outer(x, y) in place, with the BLAS rank-1 update ger (sger / dger by the dtype of M).
+    ger overwrites Fortran ordered matrices, so a C ordered M is updated through its transpose: M' += alpha * y x'.
+    For a non-contiguous M, f2py works on a copy, which is written back.
+    """
+    ger = get_blas_funcs('ger', (M,))
+    if M.flags.f_contiguous:
+        a, x, y = M, x, y
+    else:
+        a, x, y = M.T, y, x
+    out = ger(alpha, x, y, a=a, overwrite_a=True)
+    if out is not a:
+        a[...] = out
+    return M
+
+
+def _gemm_samples(xmean, sigma, Z, A):
+    """ xmean + sigma * Z @ A as a single BLAS gemm: the output is filled with the mean by broadcast and the scaled
+    product is accumulated onto it (beta = 1), one pass over the samples instead of three. Like ger, gemm overwrites
+    column major outputs, so the C ordered result is computed as its transpose, A' @ Z' + (mean rows)'.
+    Returns a new (n, M) array.
+    """
+    gemm = get_blas_funcs('gemm', (A,))
+    out = np.empty((Z.shape[0], A.shape[1]), dtype=A.dtype)
+    out[:] = xmean
+    out_T = out.T
+    res = gemm(sigma, A.T, Z.T, beta=1.0, c=out_T, overwrite_c=True)
+    return out if res is out_T else res.T  # f2py copies c when its dtype does not match the routine
+
+
+def _triu_matmul(X, R):
+    """ X @ R for a C ordered upper triangular R, with the BLAS triangular products (trmm for a matrix X, trmv for a
+    vector), half the FLOPs of the dense product. In column major terms this is R' @ X' with R' lower triangular,
+    so the transposed views are passed and nothing is copied but X into the new result.
+    """
+    if X.ndim == 1:
+        trmv = get_blas_funcs('trmv', (R,))
+        return trmv(R.T, X, lower=1)
+    trmm = get_blas_funcs('trmm', (R,))
+    out = np.array(X, dtype=R.dtype, order='C')
+    out_T = out.T
+    res = trmm(1.0, R.T, out_T, lower=1, overwrite_b=True)
+    return out if res is out_T else res.T  # f2py copies b when its dtype does not match the routine
+
+
+@njit(cache=True, fastmath=True, parallel=True)
+def _zoha_sample(xnew, innerU, mu, sphere_norm, outerV):
+    """ Sphere sampling kernel of ZOHA_Sphere_lr_euclid, parallel over the rows of innerU. For each row:
+    project it to the tangent plane of xnew, take the exponential map of mu * the projection from xnew with the
+    closed form  cos(theta) * xnew / |xnew| + sin(theta) * v / |v|,  theta = mu * |v|,  and scale to sphere_norm.
+    The projected vectors are written to `outerV`. Returns the samples, with the renormalized xnew as the first one.
+    """
+    B, N = innerU.shape
+    xnorm = math.sqrt(np.sum(xnew * xnew))
+    xhat = xnew / xnorm
+    samples = np.empty((B + 1, N), dtype=innerU.dtype)
+    for j in range(N):
+        samples[0, j] = sphere_norm * xhat[j]
+    for b in prange(B):
+        coef = 0.0
+        for j in range(N):
+            coef += innerU[b, j] * xhat[j]
+        vnorm2 = 0.0
+        for j in range(N):
+            outerV[b, j] = innerU[b, j] - coef * xhat[j]
+            vnorm2 += outerV[b, j] * outerV[b, j]
+        vnorm = math.sqrt(vnorm2)
+        cos_t = sphere_norm * math.cos(mu * vnorm)
+        sin_t = sphere_norm * math.sin(mu * vnorm) / vnorm
+        for j in range(N):
+            samples[b + 1, j] = cos_t * xhat[j] + sin_t * outerV[b, j]
+    return samples
+
+
+class AskTellMixin:
+    """ ask / tell interface on top of `step_simple`, and an `optimize` loop that evaluates each population in parallel.
+    The objective is usually the bottleneck, so the lambda candidates of a generation are scored by a process pool
+    while the optimizer itself stays in the main process.
+
+    Note: with the default process pool, the objective must be picklable (a module level function) and the script
+    creating the optimizer must be guarded by `if __name__ == '__main__':`, otherwise the spawned workers re-run it.
+    """
+    def ask(self):
+        """ Return the codes to evaluate next. The first call returns `get_init_pop()`. """
+        if getattr(self, "_asked", None) is None:
+            self._asked = self.get_init_pop() if hasattr(self, "get_init_pop") else None
+            if self._asked is None:
+                raise ValueError("No initial population, pass the first codes to `tell` or give an `init_code`.")
+        return self._asked
+
+    def tell(self, scores, codes=None):
+        """ Update with the scores of `codes` (by default the last asked codes), return the next codes to evaluate. """
+        if codes is None:
+            codes = self.ask()
+        self._asked = self.step_simple(scores, codes)
+        return self._asked
+
+    def optimize(self, objective, n_gen, n_workers=None):
+        """ Run `n_gen` generations of ask / evaluate / tell, scoring each code with `objective(code) -> float`.
+        n_workers: number of processes evaluating the population, None for all cores, 1 to evaluate in this process.
+        Return the codes, scores and generation index of every evaluation, like the Evol_experiment functions.
+        """
+        codes_all, scores_all, generations = [], [], []
+        executor = None if n_workers == 1 else ProcessPoolExecutor(max_workers=n_workers)
+        n_proc = n_workers or os.cpu_count() or 1
+        try:
+            for i in range(n_gen):
+                codes = self.ask()
+                codes_np = codes.cpu().numpy() if torch.is_tensor(codes) else np.asarray(codes)
+                if executor is None:
+                    scores = np.array([objective(code) for code in codes_np])
+                else:
+                    chunksize = max(1, len(codes_np) // (4 * n_proc))
+                    scores = np.array(list(executor.map(objective, codes_np, chunksize=chunksize)))
+                codes_all.append(codes_np.copy())
+                scores_all.append(scores)
+                generations.extend([i] * len(scores))
+                self.tell(scores)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return np.concatenate(codes_all, axis=0), np.concatenate(scores_all), np.array(generations)
+
+
+class CholeskyCMAES(AskTellMixin):
+    """ Note this is a variant of CMAES Cholesky suitable for high dimensional optimization
+    The state (A, Ainv, paths, mean, samples) is stored in `dtype`, float32 by default to halve the memory traffic
+    of the N x N products; pass dtype=np.float64 for full precision.
+    With triangular=True, A is kept as the upper triangular Cholesky factor of C and updated by Givens rotations,
+    so Ainv is never stored or updated.
+    """
     def __init__(self, space_dimen, population_size=None, init_sigma=3.0, init_code=None, Aupdate_freq=10,
-                 maximize=True, random_seed=None, optim_params={}):
+                 maximize=True, random_seed=None, optim_params={}, dtype=np.float32,
+                 triangular=False):
         N = space_dimen
         self.space_dimen = space_dimen
+        self.dtype = dtype
         # Overall control parameter
         self.maximize = maximize  # if the program is to maximize or to minimize
         # Strategy parameter setting: Selection
@@ -21,42 +254,42 @@ class CholeskyCMAES:
             # the relation between dimension and population size.
         else:
             self.lambda_ = population_size  # use custom specified population size
-        mu = self.lambda_ / 2  # number of parents/points for recombination
-        #  Select half the population size as parents
-        weights = log(mu + 1 / 2) - (log(np.arange(1, 1 + floor(mu))))  # muXone array for weighted recombination
-        self.mu = int(floor(mu))
-        self.weights = weights / sum(weights)  # normalize recombination weights array
-        mueff = self.weights.sum() ** 2 / sum(self.weights ** 2)  # variance-effectiveness of sum w_i x_i
-        self.weights.shape = (1, -1)  # Add the 1st dim 1 to the weights mat
+        #  Select half the population size as parents, weights are shared between instances with the same lambda_
+        weights, self.mu, mueff = _cma_weights(self.lambda_)
+        self.weights = weights.astype(dtype)
         self.mueff = mueff  # add to class variable
         self.sigma = init_sigma  # Note by default, sigma is None here.
         print("Space dimension: %d, Population size: %d, Select size:%d, Optimization Parameters:\nInitial sigma: %.3f"
               % (self.space_dimen, self.lambda_, self.mu, self.sigma))
         # Strategy parameter setting: Adaptation
         self.cc = 4 / (N + 4)  # defaultly  0.0009756
-        self.cs = sqrt(mueff) / (sqrt(mueff) + sqrt(N))  # 0.0499
-        self.c1 = 2 / (N + sqrt(2)) ** 2  # 1.1912701410022985e-07
+        # scalar coefficients are python floats, numpy float64 scalars would promote the float32 state
+        self.cs = math.sqrt(mueff) / (math.sqrt(mueff) + math.sqrt(N))  # 0.0499
+        self.c1 = 2 / (N + math.sqrt(2)) ** 2  # 1.1912701410022985e-07
         if "cc" in optim_params.keys():  # if there is outside value for these parameter, overwrite them
             self.cc = optim_params["cc"]
         if "cs" in optim_params.keys():
             self.cs = optim_params["cs"]
         if "c1" in optim_params.keys():
             self.c1 = optim_params["c1"]
-        self.damps = 1 + self.cs + 2 * max(0, sqrt((mueff - 1) / (N + 1)) - 1)  # damping for sigma usually  close to 1
+        self.damps = 1 + self.cs + 2 * max(0, math.sqrt((mueff - 1) / (N + 1)) - 1)  # damping for sigma usually  close to 1
 
         print("cc=%.3f, cs=%.3f, c1=%.3f damps=%.3f" % (self.cc, self.cs, self.c1, self.damps))
+        _set_update_constants(self)
+        self._skip_rank1 = _use_rank1_skip(self.c1, optim_params)
         if init_code is not None:
-            self.init_x = np.asarray(init_code)
-            self.init_x.shape = (1, N)
+            self.init_x = np.asarray(init_code, dtype=dtype).reshape(1, N)
         else:
             self.init_x = None  # FIXED Nov. 1st
-        self.xmean = zeros((1, N))
-        self.xold = zeros((1, N))
+        # The mean and paths are contiguous 1-D vectors
+        self.xmean = zeros(N, dtype=dtype)
+        self.xold = zeros(N, dtype=dtype)
         # Initialize dynamic (internal) strategy parameters and constants
-        self.pc = zeros((1, N))
-        self.ps = zeros((1, N))  # evolution paths for C and sigma
-        self.A = eye(N, N)  # covariant matrix is represent by the factors A * A '=C
-        self.Ainv = eye(N, N)
+        self.pc = zeros(N, dtype=dtype)
+        self.ps = zeros(N, dtype=dtype)  # evolution paths for C and sigma
+        self.A = eye(N, N, dtype=dtype)  # covariant matrix is represent by the factors A * A '=C
+        self.triangular = triangular
+        self.Ainv = None if triangular else eye(N, N, dtype=dtype)
 
         self.eigeneval = 0  # track update of B and D
         self.counteval = 0
@@ -64,9 +297,16 @@ class CholeskyCMAES:
             self.update_crit = self.lambda_ / self.c1 / N / 10
         else:
             self.update_crit = Aupdate_freq * self.lambda_
-        self.chiN = sqrt(N) * (1 - 1 / (4 * N) + 1 / (21 * N ** 2))
+        self.chiN = math.sqrt(N) * (1 - 1 / (4 * N) + 1 / (21 * N ** 2))
+        self._inv_chiN = 1 / float(self.chiN)
         # expectation of ||N(0,I)|| == norm(randn(N,1)) in 1/N expansion formula
         self._istep = 0
+        self._rng = _default_rng(random_seed)
+        self.randz = np.empty((self.lambda_, N), dtype=dtype)  # filled in place at every step
+        self._randzw = np.empty(N, dtype=dtype)
+        # selected rows of codes and randz, gathered with np.take into these instead of fresh fancy-index copies
+        self._sel_codes = np.empty((self.mu, N), dtype=dtype)
+        self._sel_randz = np.empty((self.mu, N), dtype=dtype)
 
     def get_init_pop(self):
         return self.init_x
@@ -79,53 +319,84 @@ class CholeskyCMAES:
         # Note to confirm with other code, this part is transposed.
         # set short name for everything to simplify equations
         N = self.space_dimen
+        codes = np.asarray(codes, dtype=self.dtype)  # no copy if already in the working dtype
         # lambda_, mu, mueff, chiN = self.lambda_, self.mu, self.mueff, self.chiN
         # cc, cs, c1, damps = self.cc, self.cs, self.c1, self.damps
         # sigma, A, Ainv, ps, pc, = self.sigma, self.A, self.Ainv, self.ps, self.pc,
         # Sort by fitness and compute weighted mean into xmean
-        if self.maximize is False:
-            code_sort_index = np.argsort( scores)  # add - operator it will do maximization.
-        else:
-            code_sort_index = np.argsort(-scores)
-        # scores = scores[code_sort_index]  # Ascending order. minimization
+        code_sort_index = top_mu_index(scores, self.mu, self.maximize)  # only the selected mu are sorted
+        select_n = len(code_sort_index)  # less than mu only if there are not enough codes
+        selected = np.take(codes, code_sort_index, axis=0, out=self._sel_codes[:select_n], mode='raise')
         if self._istep == 0:
             # Population Initialization: if without initialization, the first xmean is evaluated from weighted average all the natural images
             if self.init_x is None:
-                select_n = len(code_sort_index[0:self.mu])
-                temp_weight = self.weights[:, :select_n] / np.sum(self.weights[:, :select_n]) # in case the codes is not enough
-                self.xmean = temp_weight @ codes[code_sort_index[0:self.mu], :]
+                temp_weight = self.weights[:select_n] / np.sum(self.weights[:select_n]) # in case the codes is not enough
+                np.matmul(temp_weight, selected, out=self.xmean)
             else:
-                self.xmean = self.init_x
+                self.xmean[:] = self.init_x[0]
         else:
-            self.xold = self.xmean
-            self.xmean = self.weights @ codes[code_sort_index[0:self.mu], :]  # Weighted recombination, new mean value
+            # xmean and xold swap buffers, the GEMVs write into them without temporaries
+            self.xold, self.xmean = self.xmean, self.xold
+            np.matmul(self.weights, selected, out=self.xmean)  # Weighted recombination, new mean value
             # Cumulation statistics through steps: Update evolution paths
-            randzw = self.weights @ self.randz[code_sort_index[0:self.mu], :]
-            self.ps = (1 - self.cs) * self.ps + sqrt(self.cs * (2 - self.cs) * self.mueff) * randzw
-            self.pc = (1 - self.cc) * self.pc + sqrt(self.cc * (2 - self.cc) * self.mueff) * randzw @ self.A
-            # Adapt step size sigma
-            self.sigma = self.sigma * exp((self.cs / self.damps) * (norm(self.ps) / self.chiN - 1))
+            np.take(self.randz, code_sort_index, axis=0, out=self._sel_randz, mode='raise')
+            randzw = np.matmul(self.weights, self._sel_randz, out=self._randzw)
+            do_update = self.counteval - self.eigeneval > self.update_crit  # to achieve O(N ^ 2) do decomposition less frequently
+            # the factor update is fused into the numba step below N = _PARALLEL_MIN_DIMEN, and row-parallel above
+            fused_update = (_NUMBA_AVAILABLE and do_update and not self._skip_rank1 and not self.triangular
+                            and N < _PARALLEL_MIN_DIMEN)
+            if _NUMBA_AVAILABLE:  # paths and sigma in one in-place kernel call, no temporaries
+                # Ainv is unused in triangular mode, A stands in for it so the kernel keeps a single signature
+                self.sigma = _cma_inner(self.ps, self.pc, self.A, self.A if self.triangular else self.Ainv, randzw,
+                                        self.cs, self.cc, self._c_ps, self._c_pc, self.sigma, self._sigma_exp_coef,
+                                        self._inv_chiN, self._sqrt_1mc1, self._c1_ratio, fused_update)
+            else:
+                self.ps = (1 - self.cs) * self.ps + self._c_ps * randzw
+                self.pc = (1 - self.cc) * self.pc + self._c_pc * (_triu_matmul(randzw, self.A) if self.triangular
+                                                                  else randzw @ self.A)
+                # Adapt step size sigma
+                ps_sqnorm = float(np.dot(self.ps, self.ps))
+                self.sigma = self.sigma * math.exp(self._sigma_exp_coef * (math.sqrt(ps_sqnorm) * self._inv_chiN - 1))
             # self.sigma = self.sigma * exp((self.cs / self.damps) * (norm(ps) / self.chiN - 1))
             if verbosity: 
                 print("sigma: %.2f" % self.sigma)
             # Update A and Ainv with search path
-            if self.counteval - self.eigeneval > self.update_crit:  # to achieve O(N ^ 2) do decomposition less frequently
+            if do_update:
                 self.eigeneval = self.counteval
                 t1 = time.time()
-                v = self.pc @ self.Ainv
-                normv = v @ v.T
-                # Directly update the A Ainv instead of C itself
-                self.A = sqrt(1 - self.c1) * self.A + sqrt(1 - self.c1) / normv * (
-                            sqrt(1 + normv * self.c1 / (1 - self.c1)) - 1) * v.T @ self.pc  # FIXME, dimension error, # FIXED aug.13th
-                self.Ainv = 1 / sqrt(1 - self.c1) * self.Ainv - 1 / sqrt(1 - self.c1) / normv * (
-                            1 - 1 / sqrt(1 + normv * self.c1 / (1 - self.c1))) * self.Ainv @ v.T @ v
+                if self._skip_rank1:  # C = (1 - c1) * C, the rank-1 term is dropped (opt-in)
+                    self.A *= self._sqrt_1mc1
+                    if self.Ainv is not None:
+                        self.Ainv *= self._inv_sqrt_1mc1
+                elif self.triangular:  # Cholesky factor of C = (1 - c1) * C + c1 * pc' * pc
+                    self.A *= self._sqrt_1mc1
+                    _chol_rank1_update(self.A, math.sqrt(self.c1) * self.pc)
+                elif _NUMBA_AVAILABLE:
+                    if not fused_update:  # smaller factors were already updated inside _cma_inner
+                        _update_A_Ainv_parallel(self.A, self.Ainv, self.pc, self._sqrt_1mc1, self._c1_ratio)
+                else:
+                    v = self.pc @ self.Ainv
+                    normv = float(v @ v)
+                    # Directly update the A Ainv instead of C itself, in place. Ainv @ v is a GEMV taken before the
+                    # rank-1 BLAS updates, so no N x N temporary is allocated.
+                    sqrt_term = math.sqrt(1 + normv * self._c1_ratio)
+                    Ainv_v = self.Ainv @ v
+                    self.A *= self._sqrt_1mc1
+                    _ger_update(self.A, self._sqrt_1mc1 / normv * (sqrt_term - 1), v, self.pc)
+                    self.Ainv *= self._inv_sqrt_1mc1
+                    _ger_update(self.Ainv, -self._inv_sqrt_1mc1 / normv * (1 - 1 / sqrt_term), Ainv_v, v)
                 t2 = time.time()
                 if verbosity: 
                     print("A, Ainv update! Time cost: %.2f s" % (t2 - t1))
         # Generate new sample by sampling from Gaussian distribution
         # new_samples = zeros((self.lambda_, N))
-        self.randz = randn(self.lambda_, N)  # save the random number for generating the code.
-        new_samples = self.xmean + self.sigma * self.randz @ self.A
+        self._rng.standard_normal(dtype=self.dtype, out=self.randz)  # save the random number for generating the code.
+        if self.triangular:  # A single allocation for the returned samples, scaled and shifted in place
+            new_samples = _triu_matmul(self.randz, self.A)
+            new_samples *= self.sigma
+            new_samples += self.xmean
+        else:  # scaled product and mean in one gemm
+            new_samples = _gemm_samples(self.xmean, self.sigma, self.randz, self.A)
         self.counteval += self.lambda_
         # for k in range(self.lambda_):
         #     new_samples[k:k + 1, :] = self.xmean + sigma * (self.randz[k, :] @ A)  # m + sig * Normal(0,C)
@@ -137,6 +408,202 @@ class CholeskyCMAES:
         self._istep += 1
         return new_samples
 
+class RankOneCMAES(AskTellMixin):
+    """ Matrix free variant of CMAES for high dimensional optimization, using the rank-one covariance model of
+    Li & Zhang (R1-ES)  C = (1 - c1) * I + c1 * pc' * pc
+    Only two evolution paths are kept: `pc` shapes the covariance, `ps` adapts the step size. The factor
+    A = sqrt(1 - c1) * (I + beta * u' * u), u = pc / norm(pc), is never formed, so sampling costs O(lambda * N)
+    and no N x N matrix is allocated.
+    """
+    def __init__(self, space_dimen, population_size=None, init_sigma=3.0, init_code=None,
+                 maximize=True, random_seed=None, optim_params={}):
+        N = space_dimen
+        self.space_dimen = space_dimen
+        # Overall control parameter
+        self.maximize = maximize  # if the program is to maximize or to minimize
+        # Strategy parameter setting: Selection
+        if population_size is None:
+            self.lambda_ = int(4 + floor(3 * log2(N)))  # population size, offspring number
+        else:
+            self.lambda_ = population_size  # use custom specified population size
+        weights, self.mu, mueff = _cma_weights(self.lambda_)
+        self.weights = weights.reshape(1, -1)  # Add the 1st dim 1 to the weights mat
+        self.mueff = mueff  # add to class variable
+        self.sigma = init_sigma
+        print("Space dimension: %d, Population size: %d, Select size:%d, Optimization Parameters:\nInitial sigma: %.3f"
+              % (self.space_dimen, self.lambda_, self.mu, self.sigma))
+        # Strategy parameter setting: Adaptation, cc and c1 follow Li & Zhang 2018
+        self.cc = 2 / (N + 7)
+        self.cs = sqrt(mueff) / (sqrt(mueff) + sqrt(N))
+        self.c1 = 1 / (3 * sqrt(N) + 5)
+        if "cc" in optim_params.keys():  # if there is outside value for these parameter, overwrite them
+            self.cc = optim_params["cc"]
+        if "cs" in optim_params.keys():
+            self.cs = optim_params["cs"]
+        if "c1" in optim_params.keys():
+            self.c1 = optim_params["c1"]
+        self.damps = 1 + self.cs + 2 * max(0, sqrt((mueff - 1) / (N + 1)) - 1)  # damping for sigma usually  close to 1
+        print("cc=%.3f, cs=%.3f, c1=%.3f damps=%.3f" % (self.cc, self.cs, self.c1, self.damps))
+        _set_update_constants(self)
+        if init_code is not None:
+            self.init_x = np.asarray(init_code)
+            self.init_x.shape = (1, N)
+        else:
+            self.init_x = None
+        self.xmean = zeros((1, N))
+        self.xold = zeros((1, N))
+        # Initialize dynamic (internal) strategy parameters and constants
+        self.pc = zeros((1, N))
+        self.ps = zeros((1, N))  # evolution paths for C and sigma
+        self.u = zeros((1, N))  # unit direction of pc
+        self.beta = 0.0  # mixing coefficient of the rank-one term in the factor A
+        self.counteval = 0
+        self.chiN = sqrt(N) * (1 - 1 / (4 * N) + 1 / (21 * N ** 2))
+        self._inv_chiN = 1 / float(self.chiN)
+        self._istep = 0
+        self._rng = _default_rng(random_seed)
+
+    def get_init_pop(self):
+        return self.init_x
+
+    def transform(self, randz):
+        """ Compute randz @ A for the implicit factor A = sqrt(1 - c1) * (I + beta * u' * u) in O(lambda * N) """
+        samples = (self.beta * (randz @ self.u.T)) * self.u
+        samples += randz
+        samples *= self._sqrt_1mc1
+        return samples
+
+    def step_simple(self, scores, codes, verbosity=1):
+        """ Taking scores and codes to return new codes, without generating images
+        Used in cases when the images are better handled in outer objects like Experiment object
+        """
+        N = self.space_dimen
+        # Sort by fitness and compute weighted mean into xmean
+        code_sort_index = top_mu_index(scores, self.mu, self.maximize)  # only the selected mu are sorted
+        if self._istep == 0:
+            # Population Initialization: if without initialization, the first xmean is evaluated from weighted average all the natural images
+            if self.init_x is None:
+                select_n = len(code_sort_index)
+                temp_weight = self.weights[:, :select_n] / np.sum(self.weights[:, :select_n]) # in case the codes is not enough
+                self.xmean = temp_weight @ codes[code_sort_index, :]
+            else:
+                self.xmean = self.init_x
+        else:
+            self.xold = self.xmean
+            self.xmean = self.weights @ codes[code_sort_index, :]  # Weighted recombination, new mean value
+            # Cumulation statistics through steps: Update evolution paths
+            randzw = self.weights @ self.randz[code_sort_index, :]
+            # A is symmetric, so C^(-1/2) (xmean - xold) / sigma is randzw itself and ps needs no inverse factor.
+            self.ps = (1 - self.cs) * self.ps + self._c_ps * randzw
+            self.pc = (1 - self.cc) * self.pc + self._c_pc * self.transform(randzw)
+            # Adapt step size sigma
+            ps_flat = self.ps.ravel()
+            ps_sqnorm = float(np.dot(ps_flat, ps_flat))
+            self.sigma = self.sigma * math.exp(self._sigma_exp_coef * (math.sqrt(ps_sqnorm) * self._inv_chiN - 1))
+            if verbosity:
+                print("sigma: %.2f" % self.sigma)
+            # Rank-one factor from the new search path, (1 + beta)^2 (1 - c1) = (1 - c1) + c1 * norm(pc)^2
+            normpc = norm(self.pc)
+            if normpc > 0:
+                self.u = self.pc / normpc
+                self.beta = sqrt(1 + self._c1_ratio * normpc ** 2) - 1
+        # Generate new sample by sampling from Gaussian distribution
+        self.randz = self._rng.standard_normal((self.lambda_, N))  # save the random number for generating the code.
+        new_samples = self.xmean + self.sigma * self.transform(self.randz)
+        self.counteval += self.lambda_
+        self._istep += 1
+        return new_samples
+
+
+def top_mu_index(scores, mu, maximize=True):
+    """ Indices of the `mu` best scores, best first (all of them if there are fewer than `mu`).
+    argpartition selects them in O(lambda) and only these `mu` get sorted, the discarded tail is never ordered.
+    NaN scores rank last, as in a full argsort.
+    """
+    scores = np.asarray(scores)
+    nan_mask = np.isnan(scores)
+    if nan_mask.any():  # argpartition orders NaN above every number, map it to the worst end instead
+        scores = np.where(nan_mask, -np.inf if maximize else np.inf, scores)
+    n = len(scores)
+    if mu >= n:
+        order = np.argsort(scores)
+        return order[::-1] if maximize else order
+    if maximize:
+        idx = np.argpartition(scores, n - mu)[n - mu:]
+        return idx[np.argsort(scores[idx])[::-1]]
+    else:
+        idx = np.argpartition(scores, mu - 1)[:mu]
+        return idx[np.argsort(scores[idx])]
+
+
+def top_mu_index_torch(scores, mu, maximize=True):
+    """ torch counterpart of `top_mu_index` with topk, best first. NaN scores rank last. """
+    scores = scores.masked_fill(torch.isnan(scores), -math.inf if maximize else math.inf)
+    return torch.topk(scores, min(mu, len(scores)), largest=maximize, sorted=True)[1]
+
+
+def score_rank(scores, maximize=True):
+    """ Rank of each score, 0 for the best (descending order if maximize, ascending otherwise).
+    One argsort and a scatter of the positions, instead of a second argsort to invert the permutation.
+    """
+    scores = np.asarray(scores)
+    order = np.argsort(-scores) if maximize else np.argsort(scores)
+    code_rank = np.empty(order.size, dtype=np.intp)
+    code_rank[order] = np.arange(order.size)
+    return code_rank
+
+
+@lru_cache(maxsize=32)
+def _cma_weights(lambda_):
+    """ Log-rank recombination weights of CMA-ES for a population of lambda_, selecting the best half.
+    Return the normalized (mu,) weights, mu and the variance-effectiveness mueff. The weights array is cached and
+    shared, so it is read-only; copy it before modifying.
+    """
+    mu = lambda_ / 2  # number of parents/points for recombination
+    weights = np.log1p(mu - 1 / 2) - np.log(np.arange(1, 1 + int(mu)))  # muXone array for weighted recombination
+    weights /= weights.sum()  # normalize recombination weights array
+    mueff = float(1 / np.dot(weights, weights))  # variance-effectiveness of sum w_i x_i, as the weights sum to 1
+    weights.flags.writeable = False
+    return weights, int(floor(mu)), mueff
+
+
+@lru_cache(maxsize=32)
+def _cma_weights_torch(lambda_, device, dtype):
+    """ `_cma_weights` as a tensor on `device`, created once per (lambda_, device, dtype). Do not modify in place. """
+    weights, mu, mueff = _cma_weights(lambda_)
+    return torch.tensor(weights, device=device, dtype=dtype), mu, mueff
+
+
+def _set_update_constants(optim):
+    """ Set the constant coefficients of the CMA-ES path, step size and factor updates on `optim`, computed once from
+    its strategy parameters (cs, cc, c1, damps, mueff) instead of in every step_simple.
+    """
+    optim._c_ps = math.sqrt(optim.cs * (2 - optim.cs) * optim.mueff)
+    optim._c_pc = math.sqrt(optim.cc * (2 - optim.cc) * optim.mueff)
+    optim._sqrt_1mc1 = math.sqrt(1 - optim.c1)
+    optim._inv_sqrt_1mc1 = 1 / optim._sqrt_1mc1
+    optim._c1_ratio = optim.c1 / (1 - optim.c1)
+    optim._sigma_exp_coef = optim.cs / optim.damps
+
+
+def _use_rank1_skip(c1, optim_params):
+    """ Opt-in approximation of the factor update: with c1 below optim_params["rank1_min_c1"] (e.g. 1e-6, for
+    N = 4096 c1 ~ 1.2e-7) the rank-1 term is dropped and the update reduces to the (1 - c1) decay of C.
+    This changes the samples (A stays diagonal), so it is off by default.
+    """
+    skip = c1 < optim_params.get("rank1_min_c1", 0.0)
+    if skip:
+        print("c1=%.2e is below the rank-1 threshold, the A, Ainv update only rescales them." % c1)
+    return skip
+
+
+def _default_rng(random_seed=None):
+    """ Own PCG64 generator of an optimizer. Unseeded ones draw their seed from the global numpy RNG, so
+    np.random.seed still applies.
+    """
+    return np.random.default_rng(random_seed if random_seed is not None else np.random.randint(2 ** 31))
+
+
 def rankweight(lambda_, mu=None):
     """ Rank weight inspired by CMA-ES code
     mu is the cut off number, how many samples will be kept while `lambda_ - mu` will be ignore
@@ -151,15 +618,26 @@ def rankweight(lambda_, mu=None):
     return weights
 
 
-class CholeskyCMAES_torch:
-    """Note this is a variant of CMAES Cholesky suitable for high-dimensional optimization."""
+class CholeskyCMAES_torch(AskTellMixin):
+    """Note this is a variant of CMAES Cholesky suitable for high-dimensional optimization.
+    All the state (A, Ainv, paths, mean, RNG) stays resident on `device`, which defaults to CUDA when available.
+    With triangular=True, A is kept as the upper triangular Cholesky factor of C (the transpose of the lower factor L),
+    updated by Givens rotations on cpu and refactorized with cholesky_ex on cuda, so Ainv is never stored or updated.
+    With numpy_io=True it is a drop-in for CholeskyCMAES: codes are returned as numpy arrays.
+    """
 
     def __init__(self, space_dimen, population_size=None, init_sigma=3.0, init_code=None, Aupdate_freq=10,
-                 maximize=True, random_seed=None, optim_params={}, device='cpu', dtype=torch.float32):
+                 maximize=True, random_seed=None, optim_params={}, device=None, dtype=torch.float32,
+                 allow_tf32=True, triangular=False, numpy_io=False):
         N = space_dimen
         self.space_dimen = space_dimen
+        if device is None:
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
         self.device = torch.device(device)
         self.dtype = dtype
+        # TF32 tensor cores for the float32 randz @ A GEMM on Ampere+. The torch flag is process global, so it is
+        # only switched on around that product and restored after, leaving the other matmuls in the process alone.
+        self.allow_tf32 = allow_tf32 and self.device.type == 'cuda'
         # Overall control parameter
         self.maximize = maximize  # if the program is to maximize or to minimize
 
@@ -169,21 +647,13 @@ class CholeskyCMAES_torch:
         else:
             self.lambda_ = population_size  # use custom specified population size
 
-        mu = self.lambda_ / 2  # number of parents/points for recombination
-        self.mu = int(math.floor(mu))
-
-        # Compute weights for recombination
-        weights = torch.log(torch.tensor(mu + 0.5, device=self.device)) - \
-                  torch.log(torch.arange(1, self.mu + 1, device=self.device, dtype=self.dtype))
-        self.weights = weights / torch.sum(weights)  # normalize recombination weights array
-        self.weights = self.weights.reshape(1, -1)  # Add the 1st dim 1 to the weights matrix
+        # Recombination weights, kept 1-D for torch.mv and created once per (lambda_, device, dtype)
+        self.weights, self.mu, self.mueff = _cma_weights_torch(self.lambda_, self.device, self.dtype)
 
-        mueff = self.weights.sum() ** 2 / torch.sum(self.weights ** 2)
-        self.mueff = mueff.item()
-
-        self.sigma = init_sigma
+        # sigma is a 0-dim tensor on device, so adapting it never syncs with the host
+        self.sigma = torch.tensor(init_sigma, device=self.device, dtype=self.dtype)
         print("Space dimension: %d, Population size: %d, Select size:%d, Optimization Parameters:\nInitial sigma: %.3f"
-              % (self.space_dimen, self.lambda_, self.mu, self.sigma))
+              % (self.space_dimen, self.lambda_, self.mu, init_sigma))
 
         # Strategy parameter setting: Adaptation
         self.cc = 4 / (N + 4)
@@ -197,18 +667,21 @@ class CholeskyCMAES_torch:
 
         self.damps = 1 + self.cs + 2 * max(0, math.sqrt((self.mueff - 1) / (N + 1)) - 1)
         print("cc=%.3f, cs=%.3f, c1=%.3f, damps=%.3f" % (self.cc, self.cs, self.c1, self.damps))
+        _set_update_constants(self)
+        self._skip_rank1 = _use_rank1_skip(self.c1, optim_params)
 
         if init_code is not None:
             self.init_x = torch.tensor(init_code, device=self.device, dtype=self.dtype).reshape(1, N)
         else:
             self.init_x = None
 
-        self.xmean = torch.zeros((1, N), device=self.device, dtype=self.dtype)
-        self.xold = torch.zeros((1, N), device=self.device, dtype=self.dtype)
-        self.pc = torch.zeros((1, N), device=self.device, dtype=self.dtype)
-        self.ps = torch.zeros((1, N), device=self.device, dtype=self.dtype)
+        self.xmean = torch.zeros(N, device=self.device, dtype=self.dtype)
+        self.xold = torch.zeros(N, device=self.device, dtype=self.dtype)
+        self.pc = torch.zeros(N, device=self.device, dtype=self.dtype)
+        self.ps = torch.zeros(N, device=self.device, dtype=self.dtype)
         self.A = torch.eye(N, device=self.device, dtype=self.dtype)
-        self.Ainv = torch.eye(N, device=self.device, dtype=self.dtype)
+        self.triangular = triangular
+        self.Ainv = None if triangular else torch.eye(N, device=self.device, dtype=self.dtype)
 
         self.eigeneval = 0
         self.counteval = 0
@@ -218,74 +691,116 @@ class CholeskyCMAES_torch:
             self.update_crit = Aupdate_freq * self.lambda_
 
         self.chiN = math.sqrt(N) * (1 - 1 / (4 * N) + 1 / (21 * N ** 2))
+        self._inv_chiN = 1 / self.chiN
         self._istep = 0
+        # Persistent generator, so the RNG state lives on the device. Unseeded runs draw from torch's global RNG.
+        self._gen = torch.Generator(device=self.device)
+        self._gen.manual_seed(random_seed if random_seed is not None else int(torch.randint(2 ** 62, (1,)).item()))
+        # Side stream for the A, Ainv update, to overlap it with sampling the next randz
+        self._update_stream = torch.cuda.Stream(device=self.device) if self.device.type == 'cuda' else None
+        self.randz = torch.empty((self.lambda_, N), device=self.device, dtype=self.dtype)  # filled in place at every step
+        self.numpy_io = numpy_io
 
     def get_init_pop(self):
+        if self.numpy_io and self.init_x is not None:
+            return self.init_x.cpu().numpy()
         return self.init_x
 
     def step_simple(self, scores, codes, verbosity=1):
         """Taking scores and codes to return new codes, without generating images."""
         N = self.space_dimen
 
-        # Ensure scores and codes are tensors on the correct device
-        if not isinstance(scores, torch.Tensor):
-            scores = torch.tensor(scores, device=self.device, dtype=self.dtype)
-        if not isinstance(codes, torch.Tensor):
-            codes = torch.tensor(codes, device=self.device, dtype=self.dtype)
+        # Ensure scores and codes are tensors on the correct device, no copy if they already are
+        scores = torch.as_tensor(scores, device=self.device, dtype=self.dtype)
+        codes = torch.as_tensor(codes, device=self.device, dtype=self.dtype)
 
         # Sort by fitness and compute weighted mean into xmean
-        if self.maximize:
-            code_sort_index = torch.argsort(-scores)
-        else:
-            code_sort_index = torch.argsort(scores)
+        code_sort_index = top_mu_index_torch(scores, self.mu, self.maximize)
+        # topk indices are contiguous int64, gather the selected rows with one index_select kernel
+        selected = torch.index_select(codes, 0, code_sort_index)
 
         if self._istep == 0:
             # Population Initialization
             if self.init_x is None:
-                select_n = len(code_sort_index[:self.mu])
-                temp_weight = self.weights[:, :select_n] / torch.sum(self.weights[:, :select_n])
-                self.xmean = temp_weight @ codes[code_sort_index[:self.mu], :]
+                select_n = len(code_sort_index)
+                temp_weight = self.weights[:select_n] / torch.sum(self.weights[:select_n])
+                self.xmean = torch.mv(selected.T, temp_weight)
             else:
-                self.xmean = self.init_x
+                self.xmean = self.init_x[0]
         else:
             self.xold = self.xmean.clone()
-            self.xmean = self.weights @ codes[code_sort_index[:self.mu], :]
+            self.xmean = torch.mv(selected.T, self.weights)  # GEMV rather than a 1 x mu GEMM
 
             # Update evolution paths
-            randzw = self.weights @ self.randz[code_sort_index[:self.mu], :]
-            self.ps = (1 - self.cs) * self.ps + math.sqrt(self.cs * (2 - self.cs) * self.mueff) * randzw
-            self.pc = (1 - self.cc) * self.pc + math.sqrt(self.cc * (2 - self.cc) * self.mueff) * (randzw @ self.A)
+            randzw = torch.mv(torch.index_select(self.randz, 0, code_sort_index).T, self.weights)
+            self.ps = (1 - self.cs) * self.ps + self._c_ps * randzw
+            self.pc = (1 - self.cc) * self.pc + self._c_pc * (randzw @ self.A)
 
             # Adapt step size sigma
-            self.sigma = self.sigma * math.exp((self.cs / self.damps) * (torch.norm(self.ps) / self.chiN - 1))
-            if verbosity:
-                print("sigma: %.2f" % self.sigma)
+            self.sigma = self.sigma * torch.exp(self._sigma_exp_coef * (torch.linalg.vector_norm(self.ps) * self._inv_chiN - 1))
+            if verbosity:  # only sync when printing
+                print("sigma: %.2f" % self.sigma.item())
 
             # Update A and Ainv with search path
             if self.counteval - self.eigeneval > self.update_crit:
                 self.eigeneval = self.counteval
                 t1 = time.time()
-                v = self.pc @ self.Ainv
-                normv = (v @ v.T).item()
-                sqrt_term = math.sqrt(1 + normv * self.c1 / (1 - self.c1))
-                self.A = math.sqrt(1 - self.c1) * self.A + \
-                         (math.sqrt(1 - self.c1) / normv) * (sqrt_term - 1) * v.T @ self.pc
-                self.Ainv = (1 / math.sqrt(1 - self.c1)) * self.Ainv - \
-                            (1 / (math.sqrt(1 - self.c1) * normv)) * (1 - 1 / sqrt_term) * (self.Ainv @ v.T @ v)
+                if self._update_stream is not None:
+                    self._update_stream.wait_stream(torch.cuda.current_stream(self.device))
+                # In-place update, the factors stay owned by the default stream. No-op context on cpu.
+                # normv and sqrt_term stay 0-dim tensors and scale the vectors, so nothing syncs with the host.
+                with torch.no_grad(), torch.cuda.stream(self._update_stream):
+                    if self._skip_rank1:  # C = (1 - c1) * C, the rank-1 term is dropped (opt-in)
+                        self.A.mul_(self._sqrt_1mc1)
+                        if self.Ainv is not None:
+                            self.Ainv.mul_(self._inv_sqrt_1mc1)
+                    elif self.triangular:  # Cholesky factor of C = (1 - c1) * C + c1 * pc' * pc
+                        if self.device.type == 'cpu':  # O(N^2) Givens sweep on the shared memory of A
+                            self.A.mul_(self._sqrt_1mc1)
+                            _chol_rank1_update(self.A.numpy(), (math.sqrt(self.c1) * self.pc).numpy())
+                        else:
+                            # The N serial rotations would be N kernel launches, refactorize in one cuSOLVER call.
+                            # If the factorization fails (info != 0) the old factor is kept, selected on device so
+                            # that info is never synced to the host.
+                            C = torch.addr(self.A.T @ self.A, self.pc, self.pc, beta=1 - self.c1, alpha=self.c1)
+                            L, info = torch.linalg.cholesky_ex(C, upper=True)
+                            self.A.copy_(torch.where(info == 0, L, self.A))
+                    else:
+                        v = self.pc @ self.Ainv
+                        normv = v @ v
+                        sqrt_term = torch.sqrt(1 + normv * self._c1_ratio)
+                        Ainv_v = self.Ainv @ v
+                        self.A.mul_(self._sqrt_1mc1).addr_(v * (self._sqrt_1mc1 / normv * (sqrt_term - 1)), self.pc)
+                        self.Ainv.mul_(self._inv_sqrt_1mc1).addr_(Ainv_v * (-self._inv_sqrt_1mc1 / normv * (1 - 1 / sqrt_term)), v)
                 t2 = time.time()
                 if verbosity:
                     print("A, Ainv update! Time cost: %.2f s" % (t2 - t1))
 
         # Generate new samples
-        self.randz = torch.randn(self.lambda_, N, device=self.device, dtype=self.dtype)
-        new_samples = self.xmean + self.sigma * (self.randz @ self.A)
+        torch.randn(self.lambda_, N, generator=self._gen, out=self.randz)
+        if self._update_stream is not None:
+            torch.cuda.current_stream(self.device).wait_stream(self._update_stream)
+        if self.allow_tf32:
+            tf32_prev = torch.backends.cuda.matmul.allow_tf32
+            torch.backends.cuda.matmul.allow_tf32 = True
+            try:
+                new_samples = self.xmean + self.sigma * (self.randz @ self.A)
+            finally:
+                torch.backends.cuda.matmul.allow_tf32 = tf32_prev
+        else:
+            new_samples = self.xmean + self.sigma * (self.randz @ self.A)
         self.counteval += self.lambda_
         self._istep += 1
+        if self.numpy_io:
+            return new_samples.cpu().numpy()
         return new_samples
 
 
-class CholeskyCMAES_torch_noCMA:
-    """Note this is a variant of CMAES Cholesky suitable for high-dimensional optimization."""
+class CholeskyCMAES_torch_noCMA(AskTellMixin):
+    """Note this is a variant of CMAES Cholesky suitable for high-dimensional optimization.
+    The covariance is kept at identity, so only the step size sigma is adapted and the samples are isotropic
+    Gaussians around the mean. `Aupdate_freq` is accepted for signature compatibility with CholeskyCMAES but unused.
+    """
 
     def __init__(self, space_dimen, population_size=None, init_sigma=3.0, init_code=None, Aupdate_freq=10,
                  maximize=True, random_seed=None, optim_params={}, device='cpu'):
@@ -301,56 +816,41 @@ class CholeskyCMAES_torch_noCMA:
         else:
             self.lambda_ = population_size  # use custom specified population size
 
-        mu = self.lambda_ / 2  # number of parents/points for recombination
-        self.mu = int(math.floor(mu))
-
-        # Compute weights for recombination
-        weights = torch.log(torch.tensor(mu + 0.5, device=self.device)) - \
-                  torch.log(torch.arange(1, self.mu + 1, device=self.device, dtype=torch.float32))
-        self.weights = weights / torch.sum(weights)  # normalize recombination weights array
-        self.weights = self.weights.reshape(1, -1)  # Add the 1st dim 1 to the weights matrix
+        # Recombination weights, kept 1-D for torch.mv and created once per (lambda_, device, dtype)
+        self.weights, self.mu, self.mueff = _cma_weights_torch(self.lambda_, self.device, torch.float32)
 
-        mueff = self.weights.sum() ** 2 / torch.sum(self.weights ** 2)
-        self.mueff = mueff.item()
-
-        self.sigma = init_sigma
+        # sigma is a 0-dim tensor on device, so adapting it never syncs with the host
+        self.sigma = torch.tensor(init_sigma, device=self.device, dtype=torch.float32)
         print("Space dimension: %d, Population size: %d, Select size:%d, Optimization Parameters:\nInitial sigma: %.3f"
-              % (self.space_dimen, self.lambda_, self.mu, self.sigma))
+              % (self.space_dimen, self.lambda_, self.mu, init_sigma))
 
-        # Strategy parameter setting: Adaptation
-        self.cc = 4 / (N + 4)
+        # Strategy parameter setting: Adaptation (step size only)
         self.cs = math.sqrt(self.mueff) / (math.sqrt(self.mueff) + math.sqrt(N))
-        self.c1 = 2 / (N + math.sqrt(2)) ** 2
-
         # Overwrite parameters if provided
-        self.cc = optim_params.get("cc", self.cc)
         self.cs = optim_params.get("cs", self.cs)
-        self.c1 = optim_params.get("c1", self.c1)
 
         self.damps = 1 + self.cs + 2 * max(0, math.sqrt((self.mueff - 1) / (N + 1)) - 1)
-        print("cc=%.3f, cs=%.3f, c1=%.3f, damps=%.3f" % (self.cc, self.cs, self.c1, self.damps))
+        print("cs=%.3f, damps=%.3f" % (self.cs, self.damps))
+        self._c_ps = math.sqrt(self.cs * (2 - self.cs) * self.mueff)
+        self._sigma_exp_coef = self.cs / self.damps
 
         if init_code is not None:
             self.init_x = torch.tensor(init_code, device=self.device, dtype=torch.float32).reshape(1, N)
         else:
             self.init_x = None
 
-        self.xmean = torch.zeros((1, N), device=self.device)
-        self.xold = torch.zeros((1, N), device=self.device)
-        self.pc = torch.zeros((1, N), device=self.device)
-        self.ps = torch.zeros((1, N), device=self.device)
-        # self.A = torch.eye(N, device=self.device)
-        # self.Ainv = torch.eye(N, device=self.device)
+        self.xmean = torch.zeros(N, device=self.device)
+        self.xold = torch.zeros(N, device=self.device)
+        self.ps = torch.zeros(N, device=self.device)
 
-        self.eigeneval = 0
         self.counteval = 0
-        if Aupdate_freq is None:
-            self.update_crit = self.lambda_ / self.c1 / N / 10
-        else:
-            self.update_crit = Aupdate_freq * self.lambda_
-
         self.chiN = math.sqrt(N) * (1 - 1 / (4 * N) + 1 / (21 * N ** 2))
+        self._inv_chiN = 1 / self.chiN
         self._istep = 0
+        # Persistent generator, so the RNG state lives on the device. Unseeded runs draw from torch's global RNG.
+        self._gen = torch.Generator(device=self.device)
+        self._gen.manual_seed(random_seed if random_seed is not None else int(torch.randint(2 ** 62, (1,)).item()))
+        self.randz = torch.empty((self.lambda_, N), device=self.device)  # filled in place at every step
 
     def get_init_pop(self):
         return self.init_x
@@ -366,51 +866,34 @@ class CholeskyCMAES_torch_noCMA:
             codes = torch.tensor(codes, device=self.device, dtype=torch.float32)
 
         # Sort by fitness and compute weighted mean into xmean
-        if self.maximize:
-            code_sort_index = torch.argsort(-scores)
-        else:
-            code_sort_index = torch.argsort(scores)
+        code_sort_index = top_mu_index_torch(scores, self.mu, self.maximize)
+        # topk indices are contiguous int64, gather the selected rows with one index_select kernel
+        selected = torch.index_select(codes, 0, code_sort_index)
 
         if self._istep == 0:
             # Population Initialization
             if self.init_x is None:
-                select_n = len(code_sort_index[:self.mu])
-                temp_weight = self.weights[:, :select_n] / torch.sum(self.weights[:, :select_n])
-                self.xmean = temp_weight @ codes[code_sort_index[:self.mu], :]
+                select_n = len(code_sort_index)
+                temp_weight = self.weights[:select_n] / torch.sum(self.weights[:select_n])
+                self.xmean = torch.mv(selected.T, temp_weight)
             else:
-                self.xmean = self.init_x
+                self.xmean = self.init_x[0]
         else:
             self.xold = self.xmean.clone()
-            self.xmean = self.weights @ codes[code_sort_index[:self.mu], :]
+            self.xmean = torch.mv(selected.T, self.weights)  # GEMV rather than a 1 x mu GEMM
 
-            # Update evolution paths
-            randzw = self.weights @ self.randz[code_sort_index[:self.mu], :]
-            self.ps = (1 - self.cs) * self.ps + math.sqrt(self.cs * (2 - self.cs) * self.mueff) * randzw
-            self.pc = (1 - self.cc) * self.pc + math.sqrt(self.cc * (2 - self.cc) * self.mueff) * (randzw) #  @ self.A
+            # Update evolution path
+            randzw = torch.mv(torch.index_select(self.randz, 0, code_sort_index).T, self.weights)
+            self.ps = (1 - self.cs) * self.ps + self._c_ps * randzw
 
             # Adapt step size sigma
-            self.sigma = self.sigma * math.exp((self.cs / self.damps) * (torch.norm(self.ps) / self.chiN - 1))
-            if verbosity:
-                print("sigma: %.2f" % self.sigma)
-
-            # # Update A and Ainv with search path
-            # if self.counteval - self.eigeneval > self.update_crit:
-            #     self.eigeneval = self.counteval
-            #     t1 = time.time()
-            #     v = self.pc @ self.Ainv
-            #     normv = (v @ v.T).item()
-            #     sqrt_term = math.sqrt(1 + normv * self.c1 / (1 - self.c1))
-            #     self.A = math.sqrt(1 - self.c1) * self.A + \
-            #              (math.sqrt(1 - self.c1) / normv) * (sqrt_term - 1) * v.T @ self.pc
-            #     self.Ainv = (1 / math.sqrt(1 - self.c1)) * self.Ainv - \
-            #                 (1 / (math.sqrt(1 - self.c1) * normv)) * (1 - 1 / sqrt_term) * (self.Ainv @ v.T @ v)
-            #     t2 = time.time()
-            #     if verbosity:
-            #         print("A, Ainv update! Time cost: %.2f s" % (t2 - t1))
+            self.sigma = self.sigma * torch.exp(self._sigma_exp_coef * (torch.linalg.vector_norm(self.ps) * self._inv_chiN - 1))
+            if verbosity:  # only sync when printing
+                print("sigma: %.2f" % self.sigma.item())
 
         # Generate new samples
-        self.randz = torch.randn(self.lambda_, N, device=self.device)
-        new_samples = self.xmean + self.sigma * (self.randz) # @ self.A
+        torch.randn(self.lambda_, N, generator=self._gen, out=self.randz)
+        new_samples = self.xmean + self.sigma * self.randz
         self.counteval += self.lambda_
         self._istep += 1
         return new_samples
@@ -428,7 +911,7 @@ def rankweight_torch(lambda_, mu=None, device='cpu'):
     return weights
 
 
-class ZOHA_Sphere_lr_euclid:
+class ZOHA_Sphere_lr_euclid(AskTellMixin):
     def __init__(self, space_dimen, population_size=40, select_size=20, lr=1.5, \
                  maximize=True, rankweight=True, rankbasis=False, sphere_norm=300):
         self.dimen = space_dimen   # dimension of input space
@@ -450,6 +933,7 @@ class ZOHA_Sphere_lr_euclid:
         self.rankweight = rankweight# Switch between using raw score as weight VS use rank weight as score
         self.rankbasis = rankbasis # Ranking basis or rank weights only
         # opts # object to store options for the future need to examine or tune
+        self._rng = _default_rng()  # fills innerU in place
 
     def get_init_pop(self):
         return renormalize(np.random.randn(self.B, self.dimen), self.sphere_norm)
@@ -483,10 +967,8 @@ class ZOHA_Sphere_lr_euclid:
                 # B normalizer should go here larger cohort of codes gives more estimates
                 weights = (scores - scores[0]) / self.B # / self.mu
             else:  # use a function of rank as weight, not really gradient.
-                if not self.maximize: # note for weighted recombination, the maximization flag is here.
-                    code_rank = scores.argsort().argsort() # find rank of ascending order
-                else:
-                    code_rank = (-scores).argsort().argsort() # find rank of descending order
+                # note for weighted recombination, the maximization flag is here.
+                code_rank = score_rank(scores, self.maximize)
                 # Note the weights here are internally normalized s.t. sum up to 1, no need to normalize more.
                 raw_weights = rankweight(len(code_rank))
                 weights = raw_weights[code_rank] # map the rank to the corresponding weight of recombination
@@ -504,10 +986,8 @@ class ZOHA_Sphere_lr_euclid:
                     rankedscore = scores[1:]
                 else:
                     rankedscore = scores
-                if not self.maximize: # note for weighted recombination, the maximization flag is here.
-                    code_rank = rankedscore.argsort().argsort() # find rank of ascending order
-                else:
-                    code_rank = (-rankedscore).argsort().argsort() # find rank of descending order
+                # note for weighted recombination, the maximization flag is here.
+                code_rank = score_rank(rankedscore, self.maximize)
                 # Note the weights here are internally normalized s.t. sum up to 1, no need to normalize more.
                 raw_weights = rankweight(len(code_rank), mu=self.select_cutoff)
                 weights = raw_weights[code_rank] # map the rank to the corresponding weight of recombination
@@ -519,21 +999,29 @@ class ZOHA_Sphere_lr_euclid:
             w_mean = weights[np.newaxis,:] @ codes # mean in the euclidean space
             w_mean = w_mean / norm(w_mean) * self.sphere_norm # rescale, project it back to shell.
             self.xnew = SLERP(self.xcur, w_mean, self.lr) # use lr to spherical extrapolate
-            ang_basis_to_samp = ang_dist(codes, self.xnew)
             if verbosity:
-                print("Step size %.3f, multip learning rate %.3f, " % (ang_dist(self.xcur, self.xnew), ang_dist(self.xcur, self.xnew) * self.lr));
-                print("New basis ang to last samples mean %.3f(%.3f), min %.3f" % (mean(ang_basis_to_samp), std(ang_basis_to_samp), min(ang_basis_to_samp)));
+                ang_basis_to_samp = ang_dist_batch(codes, self.xnew)
+                step_ang = ang_dist_batch(self.xcur, self.xnew)[0, 0]
+                print("Step size %.3f, multip learning rate %.3f, " % (step_ang, step_ang * self.lr));
+                print("New basis ang to last samples mean %.3f(%.3f), min %.3f" % (mean(ang_basis_to_samp), std(ang_basis_to_samp), ang_basis_to_samp.min()));
 
         # Generate new sample by sampling from Gaussian distribution
-        self.tang_codes = zeros((self.B, N))  # Tangent vectors of exploration
-        self.innerU = randn(self.B, N)  # Isotropic gaussian distributions
-        self.outerV = self.innerU # H^{-1/2}U, more transform could be applied here!
-        self.outerV = self.outerV - (self.outerV @ self.xnew.T) @ self.xnew / norm(self.xnew) ** 2 # orthogonal projection to xnew's tangent plane.
+        self._rng.standard_normal(out=self.innerU)  # Isotropic gaussian distributions, buffers are reused in place
         mu = self.mulist[self.istep + 1] if self.istep < len(self.mulist) - 1 else self.mulist[-1]
-        new_samples = zeros((self.B + 1, N))
-        new_samples[0, :] = self.xnew
-        self.tang_codes = mu * self.outerV # m + sig * Normal(0,C)
-        new_samples[1:, :] = ExpMap(self.xnew, self.tang_codes)
+        if _NUMBA_AVAILABLE:  # fused projection, ExpMap and renormalization, parallel over the samples
+            new_samples = _zoha_sample(self.xnew[0], self.innerU, mu, self.sphere_norm, self.outerV)
+            np.multiply(self.outerV, mu, out=self.tang_codes) # Tangent vectors of exploration, m + sig * Normal(0,C)
+        else:
+            # H^{-1/2}U, more transform could be applied here! Project to xnew's tangent plane with the unit base point,
+            # one gemv for the coefficients and one broadcast update, instead of an outer product and a division.
+            xnew_hat = self.xnew / norm(self.xnew)
+            np.multiply((self.innerU @ xnew_hat[0])[:, np.newaxis], xnew_hat, out=self.outerV)
+            np.subtract(self.innerU, self.outerV, out=self.outerV)
+            new_samples = zeros((self.B + 1, N))
+            new_samples[0, :] = self.xnew
+            np.multiply(self.outerV, mu, out=self.tang_codes) # Tangent vectors of exploration, m + sig * Normal(0,C)
+            new_samples[1:, :] = ExpMap(self.xnew, self.tang_codes)
+            new_samples = renormalize(new_samples, self.sphere_norm)
         if verbosity:
             print("Current Exploration %.1f deg" % (mu * sqrt(self.dimen - 1) / np.pi * 180))
         # new_ids = [];
@@ -541,16 +1029,20 @@ class ZOHA_Sphere_lr_euclid:
         #     new_ids = [new_ids, sprintf("gen%03d_%06d", self.istep+1, self.counteval)];
         #     self.counteval = self.counteval + 1;
         self.istep = self.istep + 1
-        new_samples = renormalize(new_samples, self.sphere_norm)
         return new_samples
 
 
-class HessCMAES:
-    """ Note this is a variant of CMAES Cholesky suitable for high dimensional optimization"""
-    def __init__(self, space_dimen, population_size=None, cutoff=None, init_sigma=3.0, init_code=None, Aupdate_freq=10, maximize=True, random_seed=None, optim_params={}):
+class HessCMAES(AskTellMixin):
+    """ Note this is a variant of CMAES Cholesky suitable for high dimensional optimization
+    The state (A, Ainv, paths, mean, samples) is stored in `dtype`, float32 by default to halve the memory traffic
+    of the N x N products; pass dtype=np.float64 for full precision.
+    """
+    def __init__(self, space_dimen, population_size=None, cutoff=None, init_sigma=3.0, init_code=None, Aupdate_freq=10, maximize=True, random_seed=None, optim_params={},
+                 dtype=np.float32):
         if cutoff is None: cutoff = space_dimen
         N = cutoff
         self.code_len = space_dimen
+        self.dtype = dtype
         self.space_dimen = cutoff # Overall control parameter
         self.maximize = maximize  # if the program is to maximize or to minimize
         # Strategy parameter setting: Selection
@@ -559,31 +1051,29 @@ class HessCMAES:
             # the relation between dimension and population size.
         else:
             self.lambda_ = population_size  # use custom specified population size
-        mu = self.lambda_ / 2  # number of parents/points for recombination
-        #  Select half the population size as parents
-        weights = log(mu + 1 / 2) - (log(np.arange(1, 1 + floor(mu))))  # muXone array for weighted recombination
-        self.mu = int(floor(mu))
-        self.weights = weights / sum(weights)  # normalize recombination weights array
-        mueff = self.weights.sum() ** 2 / sum(self.weights ** 2)  # variance-effectiveness of sum w_i x_i
-        self.weights.shape = (1, -1)  # Add the 1st dim 1 to the weights mat
+        #  Select half the population size as parents, weights are shared between instances with the same lambda_
+        weights, self.mu, mueff = _cma_weights(self.lambda_)
+        self.weights = weights.astype(dtype).reshape(1, -1)  # Add the 1st dim 1 to the weights mat
         self.mueff = mueff  # add to class variable
         self.sigma = init_sigma  # Note by default, sigma is None here.
         print("Space dimension: %d, Population size: %d, Select size:%d, Optimization Parameters:\nInitial sigma: %.3f"
               % (self.space_dimen, self.lambda_, self.mu, self.sigma))
         # Strategy parameter settiself.weightsng: Adaptation
         self.cc = 4 / (N + 4)  # defaultly  0.0009756
-        self.cs = sqrt(mueff) / (sqrt(mueff) + sqrt(N))  # 0.0499
-        self.c1 = 2 / (N + sqrt(2)) ** 2  # 1.1912701410022985e-07
+        # scalar coefficients are python floats, numpy float64 scalars would promote the float32 state
+        self.cs = math.sqrt(mueff) / (math.sqrt(mueff) + math.sqrt(N))  # 0.0499
+        self.c1 = 2 / (N + math.sqrt(2)) ** 2  # 1.1912701410022985e-07
         if "cc" in optim_params.keys():  # if there is outside value for these parameter, overwrite them
             self.cc = optim_params["cc"]
         if "cs" in optim_params.keys():
             self.cs = optim_params["cs"]
         if "c1" in optim_params.keys():
             self.c1 = optim_params["c1"]
-        self.damps = 1 + self.cs + 2 * max(0, sqrt((mueff - 1) / (N + 1)) - 1)  # damping for sigma usually  close to 1
+        self.damps = 1 + self.cs + 2 * max(0, math.sqrt((mueff - 1) / (N + 1)) - 1)  # damping for sigma usually  close to 1
         print("cc=%.3f, cs=%.3f, c1=%.3f damps=%.3f" % (self.cc, self.cs, self.c1, self.damps))
+        _set_update_constants(self)
         if init_code is not None:
-            self.init_x = np.asarray(init_code).reshape(1,-1)
+            self.init_x = np.asarray(init_code, dtype=dtype).reshape(1,-1)
             # if self.init_x.shape[1] == space_dimen:
             #     self.projection = True
             # elif self.init_x.shape[1] == cutoff:
@@ -592,13 +1082,13 @@ class HessCMAES:
             #     raise ValueError
         else:
             self.init_x = None  # FIXED Nov. 1st
-        self.xmean = zeros((1, N))
-        self.xold = zeros((1, N))
+        self.xmean = zeros((1, N), dtype=dtype)
+        self.xold = zeros((1, N), dtype=dtype)
         # Initialize dynamic (internal) strategy parameters and constants
-        self.pc = zeros((1, space_dimen))
-        self.ps = zeros((1, N))  # evolution paths for C and sigma
-        self.A = eye(N, space_dimen, )  # covariant matrix is represent by the factors A * A '=C
-        self.Ainv = eye(space_dimen, N, )
+        self.pc = zeros((1, space_dimen), dtype=dtype)
+        self.ps = zeros((1, N), dtype=dtype)  # evolution paths for C and sigma
+        self.A = eye(N, space_dimen, dtype=dtype)  # covariant matrix is represent by the factors A * A '=C
+        self.Ainv = eye(space_dimen, N, dtype=dtype)
 
         self.eigeneval = 0  # track update of B and D
         self.counteval = 0
@@ -606,20 +1096,35 @@ class HessCMAES:
             self.update_crit = self.lambda_ / self.c1 / N / 10
         else:
             self.update_crit = Aupdate_freq * self.lambda_
-        self.chiN = sqrt(N) * (1 - 1 / (4 * N) + 1 / (21 * N ** 2))
+        self.chiN = math.sqrt(N) * (1 - 1 / (4 * N) + 1 / (21 * N ** 2))
+        self._inv_chiN = 1 / float(self.chiN)
         # expectation of ||N(0,I)|| == norm(randn(N,1)) in 1/N expansion formula
         self._istep = 0
+        self._rng = _default_rng(random_seed)
+        self.randz = np.empty((self.lambda_, N), dtype=dtype)  # filled in place at every step
+
+    def get_init_pop(self):
+        return self.init_x
 
     def set_Hessian(self, eigvals, eigvects, cutoff=None, expon=1/2.5):
         cutoff = self.space_dimen
         self.eigvals = eigvals[:cutoff]
         self.eigvects = eigvects[:, :cutoff]
         self.scaling = self.eigvals ** (-expon)
-        self.A = self.scaling[:,np.newaxis] * self.eigvects.T # cutoff by spacedimen
-        self.Ainv = (1 / self.scaling[np.newaxis,:]) * self.eigvects # spacedimen by cutoff
+        # A = diag(scaling) @ eigvects' and Ainv = eigvects @ diag(1 / scaling) share the eigenvectors, so they are kept
+        # factored, as one C ordered (cutoff, spacedimen) matrix and the scaling, until a rank-1 update needs them dense
+        self._scaling = self.scaling.astype(self.dtype)
+        self._eigvects_T = np.ascontiguousarray(self.eigvects.T, dtype=self.dtype)  # cutoff by spacedimen, a copy of the slice only
+        self.A, self.Ainv = None, None
         # if self.projection:
         #     self.init_x = self.init_x @ self.Ainv
 
+    def _materialize_factors(self):
+        """ Form the dense A (cutoff by spacedimen) and Ainv (spacedimen by cutoff) from the factored Hessian basis """
+        self.A = self._scaling[:, np.newaxis] * self._eigvects_T
+        self.Ainv = np.ascontiguousarray(self._eigvects_T.T / self._scaling)
+        self._eigvects_T = None
+
     def step_simple(self, scores, codes):
         """ Taking scores and codes to return new codes, without generating images
         Used in cases when the images are better handled in outer objects like Experiment object
@@ -628,51 +1133,60 @@ class HessCMAES:
         # Note to confirm with other code, this part is transposed.
         # set short name for everything to simplify equations
         N = self.space_dimen
+        codes = np.asarray(codes, dtype=self.dtype)  # no copy if already in the working dtype
         lambda_, mu, mueff, chiN = self.lambda_, self.mu, self.mueff, self.chiN
         cc, cs, c1, damps = self.cc, self.cs, self.c1, self.damps
         sigma, A, Ainv, ps, pc, = self.sigma, self.A, self.Ainv, self.ps, self.pc,
         # Sort by fitness and compute weighted mean into xmean
-        if self.maximize is False:
-            code_sort_index = np.argsort( scores)  # add - operator it will do maximization.
-        else:
-            code_sort_index = np.argsort(-scores)
+        code_sort_index = top_mu_index(scores, mu, self.maximize)  # only the selected mu are sorted
         # scores = scores[code_sort_index]  # Ascending order. minimization
         if self._istep == 0:
             # Population Initialization: if without initialization, the first xmean is evaluated from weighted average all the natural images
             if self.init_x is None:
-                select_n = len(code_sort_index[0:mu])
+                select_n = len(code_sort_index)
                 temp_weight = self.weights[:, :select_n] / np.sum(self.weights[:, :select_n]) # in case the codes is not enough
-                self.xmean = temp_weight @ codes[code_sort_index[0:mu], :]
+                self.xmean = temp_weight @ codes[code_sort_index, :]
             else:
                 self.xmean = self.init_x
         else:
             self.xold = self.xmean
-            self.xmean = self.weights @ codes[code_sort_index[0:mu], :]  # Weighted recombination, new mean value
+            self.xmean = self.weights @ codes[code_sort_index, :]  # Weighted recombination, new mean value
             # Cumulation statistics through steps: Update evolution paths
-            randzw = self.weights @ self.randz[code_sort_index[0:mu], :]
-            ps = (1 - cs) * ps + sqrt(cs * (2 - cs) * mueff) * randzw
-            pc = (1 - cc) * pc + sqrt(cc * (2 - cc) * mueff) * randzw @ A
+            randzw = self.weights @ self.randz[code_sort_index, :]
+            ps = (1 - cs) * ps + self._c_ps * randzw
+            pc = (1 - cc) * pc + self._c_pc * (randzw @ A if A is not None else
+                                                (randzw * self._scaling) @ self._eigvects_T)
             # Adapt step size sigma
-            sigma = sigma * exp((cs / damps) * (norm(ps) / chiN - 1))
+            ps_flat = ps.ravel()
+            ps_sqnorm = float(np.dot(ps_flat, ps_flat))
+            sigma = sigma * math.exp(self._sigma_exp_coef * (math.sqrt(ps_sqnorm) * self._inv_chiN - 1))
             # self.sigma = self.sigma * exp((self.cs / self.damps) * (norm(ps) / self.chiN - 1))
             print("sigma: %.2f" % sigma)
             # Update A and Ainv with search path
             if self.counteval - self.eigeneval > self.update_crit:  # to achieve O(N ^ 2) do decomposition less frequently
                 self.eigeneval = self.counteval
                 t1 = time.time()
-                v = pc @ Ainv # (1, spacedimen) * (spacedimen, N) -> (1,N)
-                normv = v @ v.T
-                # Directly update the A Ainv instead of C itself
-                A = sqrt(1 - c1) * A + sqrt(1 - c1) / normv * (
-                            sqrt(1 + normv * c1 / (1 - c1)) - 1) * v.T @ pc  # FIXME, dimension error
-                Ainv = 1 / sqrt(1 - c1) * Ainv - 1 / sqrt(1 - c1) / normv * (
-                            1 - 1 / sqrt(1 + normv * c1 / (1 - c1))) * Ainv @ v.T @ v
+                if A is None:  # the update makes the factors dense, form them from the Hessian basis
+                    self._materialize_factors()
+                    A, Ainv = self.A, self.Ainv
+                pc_flat = pc.ravel()
+                v = pc_flat @ Ainv  # (spacedimen,) * (spacedimen, N) -> (N,)
+                normv = float(np.dot(v, v))
+                Ainv_v = Ainv @ v  # one gemv, taken before Ainv is rescaled
+                # Directly update the A Ainv instead of C itself, both rank-1 terms in place with ger
+                sqrt_term = math.sqrt(1 + normv * self._c1_ratio)
+                A *= self._sqrt_1mc1
+                _ger_update(A, self._sqrt_1mc1 / normv * (sqrt_term - 1), v, pc_flat)
+                Ainv *= self._inv_sqrt_1mc1
+                _ger_update(Ainv, -self._inv_sqrt_1mc1 / normv * (1 - 1 / sqrt_term), Ainv_v, v)
                 t2 = time.time()
                 print("A, Ainv update! Time cost: %.2f s" % (t2 - t1))
         # Generate new sample by sampling from Gaussian distribution
-        new_samples = zeros((self.lambda_, N))
-        self.randz = randn(self.lambda_, N)  # save the random number for generating the code.
-        new_samples = self.xmean + sigma * self.randz @ A
+        self._rng.standard_normal(dtype=self.dtype, out=self.randz)  # save the random number for generating the code.
+        if A is not None:  # scaled product and mean in one gemm
+            new_samples = _gemm_samples(self.xmean, sigma, self.randz, A)
+        else:  # randz @ A = (randz * scaling) @ eigvects', from the factored Hessian basis
+            new_samples = _gemm_samples(self.xmean, sigma, self.randz * self._scaling, self._eigvects_T)
         self.counteval += self.lambda_
         # Clever way to generate multivariate gaussian!!
         # Stretch the guassian hyperspher with D and transform the
@@ -682,22 +1196,42 @@ class HessCMAES:
         return new_samples
 
 
-class concat_wrapper:
+class concat_wrapper(AskTellMixin):
     """Use two optimizers to work on two subspaces separately.
         optim1, optim2: any optimizer in this format
+    When both subspaces are below _PARALLEL_MIN_DIMEN, optim1 steps in a worker thread while optim2 steps in the
+    calling thread (BLAS and the serial numba kernels release the GIL). From that size on CholeskyCMAES runs the
+    row-parallel numba kernel, which must not be entered from two threads at once, so the steps run in sequence.
     """
     def __init__(self, optim1, optim2):
         self.optim1 = optim1
         self.optim2 = optim2
         self.sep = self.optim1.space_dimen
+        self.threaded = max(self.sep, getattr(self.optim2, "space_dimen", _PARALLEL_MIN_DIMEN)) < _PARALLEL_MIN_DIMEN
+        self._pool = None  # created at the first threaded step
 
     def step_simple(self, scores, codes):
-        new_codes1 = self.optim1.step_simple(scores, codes[:,:self.sep])
+        if not self.threaded:
+            new_codes1 = self.optim1.step_simple(scores, codes[:,:self.sep])
+            new_codes2 = self.optim2.step_simple(scores, codes[:,self.sep:])
+            return np.concatenate((new_codes1, new_codes2), axis=1)
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=1)
+        future1 = self._pool.submit(self.optim1.step_simple, scores, codes[:,:self.sep])
         new_codes2 = self.optim2.step_simple(scores, codes[:,self.sep:])
-        return np.concatenate((new_codes1, new_codes2), axis=1)
+        return np.concatenate((future1.result(), new_codes2), axis=1)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_pool"] = None  # the pool holds locks and threads, a copy makes its own
+        return state
+
+    def __del__(self):
+        if getattr(self, "_pool", None) is not None:
+            self._pool.shutdown(wait=False)
 
 
-class fix_param_wrapper:
+class fix_param_wrapper(AskTellMixin):
     """Fix part of parameter and optimize the other part,
         optim: any optimizer in this format
         pre: True means fix the initial part of code,
@@ -708,14 +1242,68 @@ class fix_param_wrapper:
         self.fix_code = fixed_code
         self.pre = pre  # if the fix code in in the first part
         self.sep = fixed_code.shape[1]
+        self._fix_row = np.ascontiguousarray(fixed_code).reshape(-1)
 
     def step_simple(self, scores, codes):
+        # The fixed part is broadcast into the output, no repeated copy of it is built. The output is still a new
+        # array at each step, as callers keep the returned codes.
         if self.pre:
             new_codes1 = self.optim.step_simple(scores, codes[:, self.sep:])
-            return np.concatenate((np.repeat(self.fix_code, new_codes1.shape[0], axis=0), new_codes1), axis=1)
+            new_codes = np.empty((new_codes1.shape[0], self.sep + new_codes1.shape[1]),
+                                 dtype=np.result_type(new_codes1, self._fix_row))
+            new_codes[:, :self.sep] = self._fix_row
+            new_codes[:, self.sep:] = new_codes1
         else:
             new_codes1 = self.optim.step_simple(scores, codes[:, :-self.sep])
-            return np.concatenate((new_codes1, np.repeat(self.fix_code, new_codes1.shape[0], axis=0)), axis=1)
+            new_codes = np.empty((new_codes1.shape[0], new_codes1.shape[1] + self.sep),
+                                 dtype=np.result_type(new_codes1, self._fix_row))
+            new_codes[:, :-self.sep] = new_codes1
+            new_codes[:, -self.sep:] = self._fix_row
+        return new_codes
+
+
+def _hess_cmaes(Hdata, vals_key, vects_key, expon, init_code, **kwargs):
+    """ HessCMAES set to the Hessian basis stored in Hdata, with the eigenpairs in descending order.
+    The reversed arrays are views into Hdata, set_Hessian copies only the `cutoff` eigenvectors it keeps.
+    """
+    eva = Hdata[vals_key][::-1]
+    evc = Hdata[vects_key][:, ::-1]
+    optim = HessCMAES(init_code=init_code, **kwargs)
+    optim.set_Hessian(eigvals=eva, eigvects=evc, expon=expon)
+    return optim
+
+
+# Builders of the pre-defined optimizers, called with (init_code, Hdata)
+_BIGGAN_BUILDERS = {
+    "CholCMA": lambda ic, H: CholeskyCMAES(space_dimen=256, init_code=ic, init_sigma=0.2,),
+    "CholCMA_class": lambda ic, H: fix_param_wrapper(
+        CholeskyCMAES(space_dimen=128, init_code=ic[:, 128:], init_sigma=0.06,), ic[:, :128], pre=True),
+    "CholCMA_noise": lambda ic, H: fix_param_wrapper(
+        CholeskyCMAES(space_dimen=128, init_code=ic[:, :128], init_sigma=0.3,), ic[:, 128:], pre=False),
+    "CholCMA_prod": lambda ic, H: concat_wrapper(
+        CholeskyCMAES(space_dimen=128, init_code=ic[:, :128], init_sigma=0.1,),
+        CholeskyCMAES(space_dimen=128, init_code=ic[:, 128:], init_sigma=0.06,)),
+    "CholCMA_noA": lambda ic, H: CholeskyCMAES(space_dimen=256, init_code=ic, init_sigma=0.2, Aupdate_freq=102),
+    "HessCMA": lambda ic, H: _hess_cmaes(H, 'eigvals_avg', 'eigvects_avg', 1 / 2.5, ic,
+                                         space_dimen=256, init_sigma=0.2,),
+    "HessCMA_noA": lambda ic, H: _hess_cmaes(H, 'eigvals_avg', 'eigvects_avg', 1 / 2.5, ic,
+                                             space_dimen=256, init_sigma=0.2, Aupdate_freq=102),
+    "HessCMA_class": lambda ic, H: fix_param_wrapper(
+        _hess_cmaes(H, 'eigvals_clas_avg', 'eigvects_clas_avg', 1 / 2.5, ic[:, 128:], space_dimen=128, init_sigma=0.2,),
+        ic[:, :128], pre=True),
+}
+_FC6_BUILDERS = {
+    "CholCMA": lambda ic, H: CholeskyCMAES(space_dimen=4096, init_code=ic, init_sigma=3,),
+    "CholCMA_noA": lambda ic, H: CholeskyCMAES(space_dimen=4096, init_code=ic, init_sigma=3, Aupdate_freq=102),
+    "CholCMA_gpu": lambda ic, H: CholeskyCMAES_torch(space_dimen=4096, init_code=ic, init_sigma=3, numpy_io=True),
+    "HessCMA800": lambda ic, H: _hess_cmaes(H, 'eigv_avg', 'eigvect_avg', 1 / 5, ic,
+                                            space_dimen=4096, cutoff=800, init_sigma=0.8,),
+    "HessCMA500": lambda ic, H: _hess_cmaes(H, 'eigv_avg', 'eigvect_avg', 1 / 5, ic,
+                                            space_dimen=4096, cutoff=500, init_sigma=0.8,),
+    "HessCMA500_1": lambda ic, H: _hess_cmaes(H, 'eigv_avg', 'eigvect_avg', 1 / 4, ic,
+                                              space_dimen=4096, cutoff=500, init_sigma=0.4,),
+}
+_OPTIMIZER_BUILDERS = {"BigGAN": _BIGGAN_BUILDERS, "fc6": _FC6_BUILDERS}
 
 
 def label2optimizer(methodlabel, init_code, GAN="BigGAN", Hdata=None):
@@ -726,57 +1314,8 @@ def label2optimizer(methodlabel, init_code, GAN="BigGAN", Hdata=None):
     if Hdata is None and "Hess" in methodlabel:
         # warnings for Hdata missing
         raise FileNotFoundError("Hessian not found! unable to use the Hessian based optimizers.")
-
-    if GAN == "BigGAN":
-        if methodlabel == "CholCMA":
-            optim_cust = CholeskyCMAES(space_dimen=256, init_code=init_code, init_sigma=0.2,)
-        elif methodlabel == "CholCMA_class":
-            optim = CholeskyCMAES(space_dimen=128, init_code=init_code[:, 128:], init_sigma=0.06,)
-            optim_cust = fix_param_wrapper(optim, init_code[:, :128], pre=True)
-        elif methodlabel == "CholCMA_noise":
-            optim = CholeskyCMAES(space_dimen=128, init_code=init_code[:, :128], init_sigma=0.3,)
-            optim_cust = fix_param_wrapper(optim, init_code[:, 128:], pre=False)
-        elif methodlabel == "CholCMA_prod":
-            optim1 = CholeskyCMAES(space_dimen=128, init_code=init_code[:, :128], init_sigma=0.1,)
-            optim2 = CholeskyCMAES(space_dimen=128, init_code=init_code[:, 128:], init_sigma=0.06,)
-            optim_cust = concat_wrapper(optim1, optim2)
-        elif methodlabel == "CholCMA_noA":
-            optim_cust = CholeskyCMAES(space_dimen=256, init_code=init_code, init_sigma=0.2, Aupdate_freq=102)
-        elif methodlabel == "HessCMA":
-            eva = Hdata['eigvals_avg'][::-1]
-            evc = Hdata['eigvects_avg'][:, ::-1]
-            optim_cust = HessCMAES(space_dimen=256, init_code=init_code, init_sigma=0.2, )
-            optim_cust.set_Hessian(eigvals=eva, eigvects=evc, expon=1 / 2.5)
-        elif methodlabel == "HessCMA_noA":
-            eva = Hdata['eigvals_avg'][::-1]
-            evc = Hdata['eigvects_avg'][:, ::-1]
-            optim_cust = HessCMAES(space_dimen=256, init_code=init_code, init_sigma=0.2, Aupdate_freq=102)
-            optim_cust.set_Hessian(eigvals=eva, eigvects=evc, expon=1 / 2.5)
-        elif methodlabel == "HessCMA_class":
-            eva = Hdata['eigvals_clas_avg'][::-1]
-            evc = Hdata['eigvects_clas_avg'][:, ::-1]
-            optim_hess = HessCMAES(space_dimen=128, init_code=init_code[:, 128:], init_sigma=0.2, )
-            optim_hess.set_Hessian(eigvals=eva, eigvects=evc, expon=1 / 2.5)
-            optim_cust = fix_param_wrapper(optim_hess, init_code[:, :128], pre=True)
-    elif GAN == "fc6":
-        if methodlabel == "CholCMA":
-            optim_cust = CholeskyCMAES(space_dimen=4096, init_code=init_code, init_sigma=3,)
-        elif methodlabel == "CholCMA_noA":
-            optim_cust = CholeskyCMAES(space_dimen=4096, init_code=init_code, init_sigma=3, Aupdate_freq=102)
-        elif methodlabel == "HessCMA800":
-            eva = Hdata['eigv_avg'][::-1]
-            evc = Hdata['eigvect_avg'][:, ::-1]
-            optim_cust = HessCMAES(space_dimen=4096, cutoff=800, init_code=init_code, init_sigma=0.8, )
-            optim_cust.set_Hessian(eigvals=eva, eigvects=evc, cutoff=800, expon=1 / 5)
-        elif methodlabel == "HessCMA500":
-            eva = Hdata['eigv_avg'][::-1]
-            evc = Hdata['eigvect_avg'][:, ::-1]
-            optim_cust = HessCMAES(space_dimen=4096, cutoff=500, init_code=init_code, init_sigma=0.8, )
-            optim_cust.set_Hessian(eigvals=eva, eigvects=evc, cutoff=500, expon=1 / 5)
-        elif methodlabel == "HessCMA500_1":
-            eva = Hdata['eigv_avg'][::-1]
-            evc = Hdata['eigvect_avg'][:, ::-1]
-            optim_cust = HessCMAES(space_dimen=4096, cutoff=500, init_code=init_code, init_sigma=0.4, )
-            optim_cust.set_Hessian(eigvals=eva, eigvects=evc, cutoff=500, expon=1 / 4)
-    return optim_cust
-
+    try:
+        builder = _OPTIMIZER_BUILDERS[GAN][methodlabel]
+    except KeyError:
+        raise ValueError("No pre-defined optimizer %s for GAN %s." % (methodlabel, GAN))
+    return builder(init_code, Hdata)
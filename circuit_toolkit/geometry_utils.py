@@ -15,6 +15,15 @@ def ang_dist(V1, V2):
     return ang
 
 
+def ang_dist_batch(codes, x):
+    """Angular distance of each row of `codes` to the single vector `x`, as a (B, 1) column like ang_dist.
+    One gemv on the raw codes, no normalized copy of `codes` is made."""
+    codes = np.ascontiguousarray(codes)
+    x = np.asarray(x).reshape(-1)
+    cosang = (codes @ x) / (norm(codes, axis=1) * norm(x))
+    return np.arccos(np.clip(cosang, -1, 1))[:, np.newaxis]
+
+
 # Utility functions for interpolation
 def SLERP(code1, code2, steps, lim=(0,1)):
     """Spherical Linear Interpolation for numpy arrays"""
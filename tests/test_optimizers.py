@@ -0,0 +1,120 @@
+"""Regression tests of the numerical kernels in circuit_toolkit.Optimizers against the dense NumPy formulas.
+Each update is checked both with the numba kernels and with the plain NumPy fallback path.
+"""
+import numpy as np
+import pytest
+import circuit_toolkit.Optimizers as opt
+
+
+@pytest.fixture(params=[True, False], ids=["numba", "numpy"])
+def numba_path(request, monkeypatch):
+    """ Run the test with the numba kernels (when numba is installed) and with the NumPy fallback """
+    if request.param and not opt._NUMBA_AVAILABLE:
+        pytest.skip("numba is not installed")
+    monkeypatch.setattr(opt, "_NUMBA_AVAILABLE", request.param)
+    return request.param
+
+
+def _py_func(kernel):
+    return getattr(kernel, "py_func", kernel)
+
+
+def _cma_steps(n_steps, N=12, **kwargs):
+    """ A float64 CholeskyCMAES updating its factor at every step, with the factor before and after the last step """
+    optim = opt.CholeskyCMAES(N, init_code=np.zeros((1, N)), init_sigma=0.5, Aupdate_freq=0, random_seed=0,
+                              dtype=np.float64, **kwargs)
+    codes = optim.get_init_pop()
+    for i in range(n_steps):
+        A_old = optim.A.copy()
+        codes = optim.step_simple(-((codes - 1) ** 2).sum(axis=1), codes)
+    return optim, A_old
+
+
+@pytest.mark.parametrize("jit", [True, False], ids=["numba", "numpy"])
+def test_chol_rank1_update(jit):
+    rng = np.random.default_rng(0)
+    N = 9
+    R = np.triu(rng.standard_normal((N, N))) + 3 * np.eye(N)
+    x = rng.standard_normal(N)
+    C_new = R.T @ R + np.outer(x, x)
+    kernel = opt._chol_rank1_update if jit else _py_func(opt._chol_rank1_update)
+    kernel(R, x.copy())
+    np.testing.assert_allclose(R.T @ R, C_new, rtol=1e-12, atol=1e-12)
+    np.testing.assert_array_equal(R, np.triu(R))
+
+
+def test_cholcma_triangular_update(numba_path):
+    optim, A_old = _cma_steps(4, triangular=True)
+    C_new = (1 - optim.c1) * A_old.T @ A_old + optim.c1 * np.outer(optim.pc, optim.pc)
+    np.testing.assert_allclose(optim.A.T @ optim.A, C_new, rtol=1e-10, atol=1e-12)
+    np.testing.assert_array_equal(optim.A, np.triu(optim.A))
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+@pytest.mark.parametrize("layout", ["C", "F", "strided"])
+def test_ger_update(dtype, layout):
+    rng = np.random.default_rng(1)
+    base = rng.standard_normal((7, 10)).astype(dtype)
+    M = {"C": base.copy(), "F": np.asfortranarray(base), "strided": base.copy()[:, ::2]}[layout]
+    x, y = rng.standard_normal(M.shape[0]), rng.standard_normal(M.shape[1])
+    expected = M + 0.3 * np.outer(x, y)
+    out = opt._ger_update(M, 0.3, x.astype(dtype), y.astype(dtype))
+    assert out is M
+    np.testing.assert_allclose(M, expected, rtol=1e-5 if dtype == np.float32 else 1e-12)
+
+
+def test_cholcma_update(numba_path):
+    optim, A_old = _cma_steps(4)
+    C_new = (1 - optim.c1) * A_old.T @ A_old + optim.c1 * np.outer(optim.pc, optim.pc)
+    np.testing.assert_allclose(optim.A.T @ optim.A, C_new, rtol=1e-10, atol=1e-12)
+    np.testing.assert_allclose(optim.A @ optim.Ainv, np.eye(optim.space_dimen), atol=1e-12)
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+def test_gemm_samples(dtype):
+    rng = np.random.default_rng(2)
+    xmean = rng.standard_normal(6).astype(dtype)
+    Z = rng.standard_normal((5, 6)).astype(dtype)
+    A = rng.standard_normal((6, 6)).astype(dtype)
+    samples = opt._gemm_samples(xmean, 0.7, Z, A)
+    assert samples.dtype == dtype and samples.flags.c_contiguous
+    np.testing.assert_allclose(samples, xmean + 0.7 * Z @ A, rtol=1e-5 if dtype == np.float32 else 1e-12)
+
+
+def test_cholcma_samples(numba_path):
+    optim, _ = _cma_steps(3)
+    samples = optim.step_simple(np.zeros(optim.lambda_), np.zeros((optim.lambda_, optim.space_dimen)))
+    # the samples are drawn from the mean, step size and factor that the step leaves
+    np.testing.assert_allclose(samples, optim.xmean + optim.sigma * optim.randz @ optim.A, rtol=1e-12, atol=1e-12)
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+@pytest.mark.parametrize("ndim", [1, 2])
+def test_triu_matmul(dtype, ndim):
+    rng = np.random.default_rng(3)
+    R = rng.standard_normal((8, 8)).astype(dtype)  # the lower triangle must be ignored
+    X = rng.standard_normal((5, 8) if ndim == 2 else 8).astype(dtype)
+    out = opt._triu_matmul(X, R)
+    assert out.shape == X.shape
+    np.testing.assert_allclose(out, X @ np.triu(R), rtol=1e-5 if dtype == np.float32 else 1e-12,
+                               atol=1e-5 if dtype == np.float32 else 1e-12)
+
+
+def test_cholcma_triangular_samples(numba_path):
+    optim, _ = _cma_steps(3, triangular=True)
+    samples = optim.step_simple(np.zeros(optim.lambda_), np.zeros((optim.lambda_, optim.space_dimen)))
+    np.testing.assert_allclose(samples, optim.xmean + optim.sigma * optim.randz @ np.triu(optim.A),
+                               rtol=1e-12, atol=1e-12)
+
+
+def test_rank_one_cmaes_factor():
+    N = 10
+    optim = opt.RankOneCMAES(N, init_code=np.zeros((1, N)), init_sigma=0.5, random_seed=0)
+    codes = optim.get_init_pop()
+    for i in range(4):
+        codes = optim.step_simple(-((codes - 1) ** 2).sum(axis=1), codes, verbosity=0)
+    assert optim.beta != 0
+    A = np.sqrt(1 - optim.c1) * (np.eye(N) + optim.beta * optim.u.T @ optim.u)  # the implicit factor, dense
+    np.testing.assert_allclose(A @ A, (1 - optim.c1) * np.eye(N) + optim.c1 * optim.pc.T @ optim.pc, atol=1e-12)
+    Z = np.random.default_rng(4).standard_normal((6, N))
+    np.testing.assert_allclose(optim.transform(Z), Z @ A, rtol=1e-12, atol=1e-12)